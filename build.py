@@ -4,20 +4,33 @@ Gestisce la compilazione dei progetti ricevuti tramite Celery
 """
 import os
 import sys
-import subprocess
 import hashlib
+import mmap
+import errno
+import fcntl
 import shutil
 import logging
+import threading
+import time
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Optional, List, Dict, Tuple
+from typing import Optional, List, Dict, Tuple, Any, Iterator
 from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque, OrderedDict
 import tempfile
 import json
+import shlex
+import sqlite3
+from smtplib import SMTP, SMTPServerDisconnected, SMTPException
+from email.mime.text import MIMEText
 
 from celery import Celery, Task
+from celery.exceptions import Ignore
 from celery.utils.log import get_task_logger
-from sqlmodel import Session, select, create_engine
+from celery.signals import worker_process_init, worker_process_shutdown, celeryd_after_setup
+from sqlmodel import Session, select
+from sqlalchemy import insert
 from pydantic import BaseModel
 import paramiko
 import git
@@ -26,12 +39,15 @@ import git
 from models import (
     BuildStatus, RepositoryType, 
     Repository, Build, Artifact, Platform, Builder,
-    Distribution, Architecture, User
+    Distribution, Architecture, User,
+    create_db_engine
 )
 
 # Configurazione database
 DATABASE_URL = os.getenv('DATABASE_URL', None)
-engine = create_engine(DATABASE_URL, echo=False)
+DB_POOL_SIZE = int(os.getenv('INAU_DB_POOL_SIZE', 2))
+DB_MAX_OVERFLOW = int(os.getenv('INAU_DB_MAX_OVERFLOW', 4))
+engine = create_db_engine(DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW)
 
 # Configurazione Celery
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', None)
@@ -40,12 +56,32 @@ CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', None)
 # Configurazione paths
 REPO_BASE_DIR = os.getenv('INAU_REPO_DIR', None)
 STORE_BASE_DIR = os.getenv('INAU_STORE_DIR', None)
+SSH_KEY_FILE = os.getenv('INAU_SSH_KEY', os.path.expanduser('~/.ssh/id_rsa'))
+SSH_KNOWN_HOSTS = os.getenv('INAU_SSH_KNOWN_HOSTS', os.path.expanduser('~/.ssh/known_hosts'))
+SSH_COMPRESSION = os.getenv('INAU_SSH_COMPRESSION', '1') == '1'
+# Indice locale all'host: SQLite in WAL non funziona su filesystem di rete come lo store
+STAT_CACHE_PATH = os.getenv('INAU_STAT_CACHE', os.path.expanduser('~/.cache/inau/stat-hashes.sqlite'))
+STAT_MEMO_SIZE = int(os.getenv('INAU_STAT_MEMO_SIZE', 100000))  # Voci stat -> hash tenute in memoria
 BUILD_TIMEOUT = int(os.getenv('INAU_BUILD_TIMEOUT', 3600))
+# Oltre questo tempo Redis riconsegna i task non confermati: deve superare l'hard limit
+VISIBILITY_TIMEOUT = int(os.getenv('INAU_VISIBILITY_TIMEOUT', 2 * (BUILD_TIMEOUT + 300)))
+MAX_TASKS_PER_CHILD = int(os.getenv('INAU_MAX_TASKS_PER_CHILD', 100))
+MAKEFILES_URL = "https://gitlab.elettra.eu/cs/ds/makefiles.git"
+MAKEFILES_REFRESH = int(os.getenv('INAU_MAKEFILES_REFRESH', 300))  # Secondi tra due fetch del mirror
+HASH_WORKERS = int(os.getenv('INAU_HASH_WORKERS', 8))
+HASH_INLINE_MAX = int(os.getenv('INAU_HASH_INLINE_MAX', 4))  # Sotto questa soglia si calcola nel thread del task
+MMAP_MIN_SIZE = 256 * 1024  # Sotto questa dimensione si legge il file invece di mapparlo
+FICLONE = 0x40049409  # ioctl Linux per il reflink di un intero file
+MTIME_SLACK = int(os.getenv('INAU_MTIME_SLACK', 60))  # Tolleranza (s) sugli orologi dei builder
+BUILD_OUTPUT_TAIL = int(os.getenv('INAU_BUILD_OUTPUT_TAIL', 65536))  # Byte di output conservati
 
 # Configurazione email
 SMTP_SERVER = os.getenv('SMTP_SERVER', None)
 SMTP_DOMAIN = os.getenv('SMTP_DOMAIN', None)
 SMTP_SENDER = os.getenv('SMTP_SENDER', None)
+SMTP_FROM = f"{SMTP_SENDER}@{SMTP_DOMAIN}"
+NOTIFY_CACHE_TTL = int(os.getenv('INAU_NOTIFY_CACHE_TTL', 300))
+NOTIFY_QUEUE = os.getenv('INAU_NOTIFY_QUEUE', 'notify_queue')
 
 # Setup Celery
 app = Celery('inau.build', broker=CELERY_BROKER_URL, backend=CELERY_RESULT_BACKEND)
@@ -61,7 +97,18 @@ app.conf.update(
     task_time_limit=BUILD_TIMEOUT + 300,  # Hard limit
     task_soft_time_limit=BUILD_TIMEOUT,    # Soft limit
     worker_prefetch_multiplier=1,
-    worker_max_tasks_per_child=10,
+    # Il riciclo del processo svuota pool SSH, repository aperti e cache degli hash
+    worker_max_tasks_per_child=MAX_TASKS_PER_CHILD,
+    # Le build arrivano su una coda per piattaforma (build_queue_platform_<id>, vedi webhook.py):
+    # avviare un worker per coda, es. "celery -A build worker -Q build_queue_platform_1 -c 2".
+    # Le notifiche email viaggiano su una coda separata, che ogni worker di build
+    # consuma in aggiunta alle proprie (vedi add_notify_queue)
+    task_routes={'inau.notify.send': {'queue': NOTIFY_QUEUE}},
+    # L'ack a fine task riconsegna le build dei worker morti durante la compilazione:
+    # process_build le chiude come fallite invece di ripeterle
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    broker_transport_options={'visibility_timeout': VISIBILITY_TIMEOUT},
 )
 
 # Logger
@@ -73,6 +120,7 @@ class BuildTask(BaseModel):
     repository_id: int
     platform_id: int
     tag: str
+    tag_sha: Optional[str] = None
     repository_name: str
     repository_url: str
     repository_type: int
@@ -80,13 +128,340 @@ class BuildTask(BaseModel):
     default_branch: str = "master"
     emails: List[str] = []
 
+class SSHConnectionPool:
+    """Pool di connessioni SSH autenticate, riutilizzate tra le build per (host, utente)"""
+    
+    def __init__(self, username: str, key_filename: str, known_hosts: str,
+                 port: int = 22, keepalive: int = 30):
+        self.username = username
+        self.key_filename = key_filename
+        self.known_hosts = known_hosts
+        self.port = port
+        self.keepalive = keepalive
+        self._pkey: Optional[paramiko.PKey] = None
+        self._host_keys: Optional[paramiko.HostKeys] = None
+        self._transports: Dict[Tuple[str, str], paramiko.Transport] = {}
+        self._nproc: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        
+    def _get_pkey(self) -> paramiko.PKey:
+        """Carica la chiave privata una sola volta per processo"""
+        if self._pkey is None:
+            # Ed25519 ha l'autenticazione più rapida; RSA resta supportata
+            for key_class in (paramiko.Ed25519Key, paramiko.ECDSAKey, paramiko.RSAKey):
+                try:
+                    self._pkey = key_class.from_private_key_file(self.key_filename)
+                    break
+                except paramiko.SSHException:
+                    continue
+            else:
+                raise paramiko.SSHException(f"Unsupported private key {self.key_filename}")
+        return self._pkey
+        
+    def _get_host_keys(self) -> paramiko.HostKeys:
+        """Carica una sola volta le host key note dei builder"""
+        if self._host_keys is None:
+            self._host_keys = paramiko.HostKeys(self.known_hosts)
+        return self._host_keys
+        
+    def _known_hostname(self, host: str) -> str:
+        """Nome dell'host come compare in known_hosts"""
+        return host if self.port == 22 else f"[{host}]:{self.port}"
+        
+    def _prefer_known_key_types(self, host: str, transport: paramiko.Transport):
+        """Negozia per primi i tipi di host key registrati, come fa SSHClient.connect
+        
+        Paramiko preferisce ed25519: un builder registrato solo con RSA o ECDSA
+        risulterebbe altrimenti sconosciuto.
+        """
+        known = self._get_host_keys().lookup(self._known_hostname(host))
+        if not known:
+            return
+        known_types = set(known.keys())
+        # Una chiave RSA registrata come ssh-rsa vale anche per le firme rsa-sha2-*
+        if "ssh-rsa" in known_types:
+            known_types.update(("rsa-sha2-512", "rsa-sha2-256"))
+        options = transport.get_security_options()
+        options.key_types = (
+            [key_type for key_type in options.key_types if key_type in known_types]
+            + [key_type for key_type in options.key_types if key_type not in known_types]
+        )
+        
+    def _verify_host_key(self, host: str, transport: paramiko.Transport):
+        """Rifiuta builder con host key sconosciuta o diversa da quella registrata"""
+        server_key = transport.get_remote_server_key()
+        hostname = self._known_hostname(host)
+        known = self._get_host_keys().lookup(hostname)
+        if known is None or server_key.get_name() not in known:
+            raise paramiko.SSHException(f"Unknown host key for {hostname}")
+        if known[server_key.get_name()] != server_key:
+            raise paramiko.BadHostKeyException(hostname, server_key, known[server_key.get_name()])
+        
+    def acquire(self, host: str) -> paramiko.Transport:
+        """Restituisce un Transport attivo verso l'host, aprendolo se necessario"""
+        key = (host, self.username)
+        with self._lock:
+            transport = self._transports.get(key)
+            if transport is not None and transport.is_active():
+                return transport
+            if transport is not None:
+                transport.close()
+                
+            transport = paramiko.Transport((host, self.port))
+            # L'output delle build è testo: la compressione riduce i byte sul canale
+            transport.use_compression(SSH_COMPRESSION)
+            try:
+                self._prefer_known_key_types(host, transport)
+                transport.start_client()
+                self._verify_host_key(host, transport)
+                transport.auth_publickey(self.username, self._get_pkey())
+            except Exception:
+                transport.close()
+                raise
+            transport.set_keepalive(self.keepalive)
+            self._transports[key] = transport
+            return transport
+            
+    def open_session(self, host: str) -> paramiko.Channel:
+        """Apre un canale sull'host, riconnettendo una volta se la connessione in pool è caduta"""
+        try:
+            return self.acquire(host).open_session()
+        except (paramiko.SSHException, EOFError, OSError):
+            self.evict(host)
+            return self.acquire(host).open_session()
+            
+    def nproc(self, host: str) -> int:
+        """Numero di CPU online dell'host, interrogato una sola volta per connessione"""
+        with self._lock:
+            if host in self._nproc:
+                return self._nproc[host]
+        with self.open_session(host) as chan:
+            chan.exec_command("getconf _NPROCESSORS_ONLN")
+            output = chan.makefile('rb').read().strip()
+        nproc = int(output) if output.isdigit() else 1
+        with self._lock:
+            self._nproc[host] = nproc
+        return nproc
+            
+    def evict(self, host: str):
+        """Chiude e rimuove dal pool la connessione verso l'host"""
+        with self._lock:
+            self._nproc.pop(host, None)
+            transport = self._transports.pop((host, self.username), None)
+        if transport is not None:
+            transport.close()
+            
+    def close_all(self):
+        """Chiude tutte le connessioni del pool"""
+        with self._lock:
+            transports = list(self._transports.values())
+            self._transports.clear()
+            self._nproc.clear()
+        for transport in transports:
+            transport.close()
+
+ssh_pool = SSHConnectionPool("inau", SSH_KEY_FILE, SSH_KNOWN_HOSTS)
+
+def stat_cache_key(st: os.stat_result) -> str:
+    """Chiave dell'indice stat -> hash: cambia se il file viene riscritto"""
+    return f"{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+
+class StatHashCache:
+    """Indice persistente (dev, inode, size, mtime_ns) -> hash, condiviso tra i worker dello stesso host
+    
+    Usa SQLite in modalità WAL, che gestisce gli accessi concorrenti di più processi
+    solo su un filesystem locale: il file non va messo su storage condiviso (NFS).
+    Va usato solo dal thread del task, non dai thread del pool di hashing.
+    """
+    
+    BATCH_SIZE = 500  # Sotto il limite di parametri per statement di SQLite
+    
+    def __init__(self, path: Path, memo_size: int):
+        self.path = path
+        self.memo_size = memo_size
+        self._conn: Optional[sqlite3.Connection] = None
+        # LRU in memoria davanti a SQLite: le build ripetute nello stesso processo non interrogano il file
+        self._memo: "OrderedDict[str, str]" = OrderedDict()
+        
+    def _remember(self, key: str, file_hash: str):
+        self._memo[key] = file_hash
+        self._memo.move_to_end(key)
+        if len(self._memo) > self.memo_size:
+            self._memo.popitem(last=False)
+        
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path), timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS stat_hashes (key TEXT PRIMARY KEY, hash TEXT NOT NULL)"
+            )
+        return self._conn
+        
+    def get_many(self, keys) -> Dict[str, str]:
+        """Restituisce gli hash noti per le chiavi richieste"""
+        result = {}
+        missing = []
+        for key in keys:
+            file_hash = self._memo.get(key)
+            if file_hash is None:
+                missing.append(key)
+            else:
+                self._memo.move_to_end(key)
+                result[key] = file_hash
+        if not missing:
+            return result
+            
+        conn = self._connect()
+        for i in range(0, len(missing), self.BATCH_SIZE):
+            batch = missing[i:i + self.BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            for key, file_hash in conn.execute(
+                f"SELECT key, hash FROM stat_hashes WHERE key IN ({placeholders})", batch
+            ):
+                self._remember(key, file_hash)
+                result[key] = file_hash
+        return result
+        
+    def put_many(self, items):
+        """Registra le coppie (chiave, hash) appena calcolate"""
+        items = list(items)
+        if not items:
+            return
+        conn = self._connect()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO stat_hashes (key, hash) VALUES (?, ?)", items)
+        for key, file_hash in items:
+            self._remember(key, file_hash)
+            
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+stat_hash_cache = StatHashCache(Path(STAT_CACHE_PATH), STAT_MEMO_SIZE)
+
+# Pool per l'hashing degli artifacts: hashlib rilascia il GIL, i thread bastano
+hash_executor = ThreadPoolExecutor(max_workers=min(HASH_WORKERS, os.cpu_count() or 1))
+
+@celeryd_after_setup.connect
+def add_notify_queue(sender, instance, **kwargs):
+    """Aggiunge la coda delle notifiche a quelle del worker, qualunque sia il -Q usato all'avvio"""
+    instance.app.amqp.queues.select_add(NOTIFY_QUEUE)
+
+@worker_process_init.connect
+def reset_engine_pool(**kwargs):
+    """Dopo il fork il processo figlio non deve riusare le connessioni del padre"""
+    engine.dispose(close=False)
+
+@worker_process_shutdown.connect
+def close_ssh_pool(**kwargs):
+    """Chiude connessioni SSH e SMTP, pool di hashing e indice degli hash quando il processo worker viene riciclato"""
+    ssh_pool.close_all()
+    hash_executor.shutdown(wait=False)
+    stat_hash_cache.close()
+    close_smtp()
+
+# Oggetti git.Repo riutilizzati tra i task dello stesso processo worker
+_repo_cache: Dict[Path, git.Repo] = {}
+
+def open_repo(path: Path) -> git.Repo:
+    """Restituisce il git.Repo per path, aprendolo una sola volta per processo"""
+    repo = _repo_cache.get(path)
+    if repo is None:
+        repo = _repo_cache[path] = git.Repo(path)
+    return repo
+
+def clone_repo(url: str, path: Path, **kwargs) -> git.Repo:
+    """Clona il repository e registra il git.Repo risultante nella cache"""
+    repo = _repo_cache[path] = git.Repo.clone_from(url, path, **kwargs)
+    return repo
+
+def walk_files(root: Path) -> Iterator[Tuple[os.DirEntry, str]]:
+    """Visita ricorsiva con os.scandir: restituisce (voce, path relativo a root) per le non-directory
+    
+    I DirEntry riusano il tipo letto da getdents, evitando uno stat per file;
+    il path relativo è costruito per prefissi, senza os.path.relpath.
+    I symlink a directory non vengono seguiti.
+    """
+    stack = [(str(root), "")]
+    while stack:
+        path, prefix = stack.pop()
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append((entry.path, prefix + entry.name + "/"))
+                else:
+                    yield entry, prefix + entry.name
+
+@contextmanager
+def path_lock(lock_path: Path, blocking: bool = True):
+    """Lock esclusivo (flock) sul file lock_path, per serializzare tra processi l'uso di un repository
+    
+    Restituisce False se blocking è falso e il lock è già tenuto da un altro processo.
+    Il kernel rilascia il lock anche se il processo che lo tiene muore.
+    """
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+_notifiable_cache: Dict[str, Any] = {"time": None, "recipients": ()}
+
+def get_notifiable_recipients(session: Session) -> Tuple[str, ...]:
+    """Indirizzi degli utenti con notifiche abilitate, ricaricati al più ogni NOTIFY_CACHE_TTL secondi"""
+    now = time.monotonic()
+    if _notifiable_cache["time"] is None or now - _notifiable_cache["time"] > NOTIFY_CACHE_TTL:
+        names = session.exec(select(User.name).where(User.notify == True)).all()
+        _notifiable_cache["recipients"] = tuple(f"{name}@{SMTP_DOMAIN}" for name in names)
+        _notifiable_cache["time"] = now
+    return _notifiable_cache["recipients"]
+
+# Connessione SMTP del processo worker, riusata tra le notifiche
+_smtp: Optional[SMTP] = None
+
+def get_smtp() -> SMTP:
+    """Restituisce la connessione SMTP del processo, aprendola se necessario"""
+    global _smtp
+    if _smtp is None:
+        _smtp = SMTP(SMTP_SERVER, 25)
+    return _smtp
+
+def close_smtp():
+    """Chiude la connessione SMTP del processo, ignorando errori di rete"""
+    global _smtp
+    if _smtp is not None:
+        try:
+            _smtp.quit()
+        except (SMTPException, OSError):
+            _smtp.close()
+        _smtp = None
+
+# Directory di piattaforma già create da questo processo
+_ready_dirs: set = set()
+
+# Hash presenti nello store, visti da questo processo (aggiornato dai thread di hashing)
+_stored_hashes: set = set()
+_store_dirs: set = set()
+
 class BuildWorker:
     """Gestisce il processo di build per una piattaforma specifica"""
     
     def __init__(self, platform_id: int):
         self.platform_id = platform_id
         self.platform_dir = Path(REPO_BASE_DIR) / str(platform_id)
-        self.platform_dir.mkdir(parents=True, exist_ok=True)
+        # Un BuildWorker nasce a ogni task: la directory si crea una volta per processo
+        if self.platform_dir not in _ready_dirs:
+            self.platform_dir.mkdir(parents=True, exist_ok=True)
+            _ready_dirs.add(self.platform_dir)
         
     @contextmanager
     def get_session(self):
@@ -101,48 +476,49 @@ class BuildWorker:
         ).first()
         
     def update_repository(self, task: BuildTask) -> Tuple[bool, str]:
-        """Aggiorna o clona il repository"""
+        """Aggiorna o clona il repository (solo il tag richiesto, in shallow)"""
         repo_path = self.platform_dir / task.repository_name
         
         try:
             # Aggiorna makefiles se necessario
-            makefiles_path = self.platform_dir / "cs/ds/makefiles"
-            if not makefiles_path.exists():
-                logger.info(f"Cloning makefiles repository...")
-                git.Repo.clone_from(
-                    "https://gitlab.elettra.eu/cs/ds/makefiles.git",
-                    makefiles_path,
-                    recurse_submodules='true'
-                )
-            else:
-                logger.info(f"Updating makefiles repository...")
-                makefiles_repo = git.Repo(makefiles_path)
-                makefiles_repo.remotes.origin.fetch()
-                makefiles_repo.git.reset('--hard', 'origin/master')
+            self.update_makefiles()
             
-            # Gestione del repository del progetto
+            # Gestione del repository del progetto: si scarica solo il tag da compilare
             if repo_path.exists():
                 logger.info(f"Updating repository {task.repository_name}...")
-                repo = git.Repo(repo_path)
-                repo.remotes.origin.fetch(tags=True)
-                repo.git.pull('--tags')
+                repo = open_repo(repo_path)
+                # Il tag è già presente con lo stesso oggetto annunciato dal webhook: niente fetch
+                if not self._has_tag(repo, task.tag, task.tag_sha):
+                    repo.git.fetch(
+                        '--depth=1', '--no-tags', 'origin',
+                        f'+refs/tags/{task.tag}:refs/tags/{task.tag}'
+                    )
+                cloned = False
             else:
                 logger.info(f"Cloning repository {task.repository_name}...")
-                repo = git.Repo.clone_from(
+                # Opzioni come kwargs: multi_options viene ri-tokenizzato con shlex
+                # e un tag con apici produrrebbe argomenti sbagliati
+                repo = clone_repo(
                     task.repository_url,
                     repo_path,
-                    recurse_submodules='true'
+                    depth=1,
+                    branch=task.tag,
+                    single_branch=True,
+                    recurse_submodules=True,
+                    shallow_submodules=True
                 )
+                cloned = True
                 
             # Verifica che il tag sia nel branch di default
-            branches = repo.git.branch('--no-color', '--contains', task.tag).split('\n')
-            if not any(task.default_branch in branch for branch in branches):
+            if not self._tag_in_branch(repo, task.tag, task.default_branch):
                 return False, f"Tag {task.tag} not found in default branch {task.default_branch}"
                 
-            # Checkout del tag
-            logger.info(f"Checking out tag {task.tag}...")
-            repo.git.reset('--hard', task.tag, '--')
-            repo.git.submodule('update', '--init', '--force', '--recursive')
+            # Checkout del tag: un clone appena fatto è già sul tag, submodule inclusi
+            if not cloned:
+                logger.info(f"Checking out tag {task.tag}...")
+                repo.git.reset('--hard', task.tag, '--')
+                if (repo_path / ".gitmodules").exists():
+                    repo.git.submodule('update', '--init', '--force', '--recursive', '--depth=1')
             
             return True, "Repository updated successfully"
             
@@ -150,52 +526,135 @@ class BuildWorker:
             logger.error(f"Error updating repository: {str(e)}")
             return False, str(e)
             
+    def update_makefiles(self):
+        """Aggiorna il mirror condiviso dei makefiles e il worktree della piattaforma"""
+        mirror_path = Path(REPO_BASE_DIR) / "_mirrors" / "makefiles.git"
+        makefiles_path = self.platform_dir / "cs/ds/makefiles"
+        
+        # Il mirror è condiviso tra i worker di tutte le piattaforme
+        with path_lock(mirror_path.with_suffix(".lock")):
+            if not mirror_path.exists():
+                logger.info(f"Cloning makefiles mirror...")
+                mirror = clone_repo(MAKEFILES_URL, mirror_path, mirror=True)
+            else:
+                mirror = open_repo(mirror_path)
+                # FETCH_HEAD è condiviso tra i processi: basta un fetch per intervallo
+                fetch_head = mirror_path / "FETCH_HEAD"
+                if not fetch_head.exists() or time.time() - fetch_head.stat().st_mtime > MAKEFILES_REFRESH:
+                    logger.info(f"Updating makefiles mirror...")
+                    mirror.git.fetch('--prune', 'origin')
+                
+            # Le vecchie piattaforme avevano un clone completo al posto del worktree
+            if (makefiles_path / ".git").is_dir():
+                _repo_cache.pop(makefiles_path, None)
+                shutil.rmtree(makefiles_path)
+                
+            if not makefiles_path.exists():
+                mirror.git.worktree('prune')
+                mirror.git.worktree('add', '--force', '--detach', str(makefiles_path), 'master')
+                makefiles = open_repo(makefiles_path)
+            else:
+                makefiles = open_repo(makefiles_path)
+                # Il reset serve solo se master è effettivamente avanzato
+                if makefiles.head.commit == makefiles.commit('master'):
+                    return
+                makefiles.git.reset('--hard', 'master')
+                
+        if (makefiles_path / ".gitmodules").exists():
+            makefiles.git.submodule('update', '--init', '--force', '--recursive')
+            
+    def _has_tag(self, repo: git.Repo, tag: str, tag_sha: Optional[str]) -> bool:
+        """Verifica, senza lanciare processi git, che il tag locale punti all'oggetto atteso"""
+        if not tag_sha:
+            return False
+        try:
+            return repo.tags[tag].object.hexsha == tag_sha
+        except (IndexError, ValueError):
+            return False
+            
+    def _tag_in_branch(self, repo: git.Repo, tag: str, branch: str) -> bool:
+        """Verifica che il tag sia raggiungibile dal branch remoto senza scaricarne tutta la storia"""
+        heads = repo.git.ls_remote('--heads', 'origin', f'refs/heads/{branch}')
+        if not heads:
+            return False
+        branch_sha = heads.split()[0]
+        tag_commit = repo.commit(f'{tag}^{{commit}}')
+        if tag_commit.hexsha == branch_sha:
+            return True
+        
+        # Caso ambiguo: serve la storia del branch, ma solo fino alla data del tag.
+        # Niente --filter: renderebbe il working copy un partial clone permanente
+        since = datetime.utcfromtimestamp(tag_commit.committed_date) - timedelta(days=1)
+        repo.git.fetch(
+            f"--shallow-since={since:%Y-%m-%d}", '--no-tags', 'origin',
+            f'+refs/heads/{branch}:refs/remotes/origin/{branch}'
+        )
+        return repo.is_ancestor(tag_commit, f'origin/{branch}')
+            
     def build_on_builder(self, builder: Builder, task: BuildTask) -> Tuple[int, str]:
         """Esegue la build su un builder remoto"""
         repo_path = self.platform_dir / task.repository_name
         
         try:
-            with paramiko.SSHClient() as ssh:
-                ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                ssh.connect(
-                    hostname=builder.name,
-                    port=22,
-                    username="inau",
-                    key_filename=os.path.expanduser("~/.ssh/id_rsa")
-                )
+            # Prepara lo script di build, inviato tutto insieme sullo stdin di bash
+            script = []
+            if builder.environment:
+                script.append(f"source {shlex.quote(builder.environment)}")
+            script.append("source /etc/profile")
+            script.append(f"cd {shlex.quote(str(repo_path))} || exit 1")
+            
+            # Parallelismo esplicito, con tetto sul load average per i builder condivisi
+            jobs = builder.jobs or ssh_pool.nproc(builder.name)
+            make_cmd = f"make -j{jobs} -l{jobs}"
+            
+            if task.repository_type == RepositoryType.LIBRARY:
+                script.append(f"{make_cmd} && rm -fr .install && PREFIX=.install make install")
+            else:
+                script.append(make_cmd)
                 
-                # Prepara il comando di build
-                environment = builder.environment or ""
-                if environment:
-                    environment = f"source {environment}; "
-                    
-                base_cmd = f"{environment}source /etc/profile; cd {repo_path}"
+            logger.info(f"Executing build command on {builder.name}...")
+            with ssh_pool.open_session(builder.name) as chan:
+                # Nessuna pty: stderr unito a stdout direttamente dal canale
+                chan.set_combine_stderr(True)
+                chan.exec_command("bash -s")
+                chan.sendall(("\n".join(script) + "\n").encode())
+                chan.shutdown_write()
                 
-                if task.repository_type == RepositoryType.LIBRARY:
-                    build_cmd = (
-                        f"{base_cmd}; "
-                        f"make -j$(getconf _NPROCESSORS_ONLN) && "
-                        f"rm -fr .install && "
-                        f"PREFIX=.install make install"
-                    )
-                else:
-                    build_cmd = f"{base_cmd}; make -j$(getconf _NPROCESSORS_ONLN)"
-                    
-                logger.info(f"Executing build command on {builder.name}...")
-                stdin, stdout, stderr = ssh.exec_command(f"({build_cmd}) 2>&1")
+                # Legge l'output fino alla chiusura del canale tenendo solo la coda
+                tail = deque()
+                tail_size = 0
+                while True:
+                    data = chan.recv(65536)
+                    if not data:
+                        break
+                    tail.append(data)
+                    tail_size += len(data)
+                    while tail_size - len(tail[0]) >= BUILD_OUTPUT_TAIL:
+                        tail_size -= len(tail.popleft())
+                exit_status = chan.recv_exit_status()
                 
-                # Attendi il completamento
-                exit_status = stdout.channel.recv_exit_status()
-                output = stdout.read().decode('utf-8', errors='replace')
+            output = b"".join(tail)[-BUILD_OUTPUT_TAIL:].decode('utf-8', errors='replace')
                 
-                return exit_status, output
+            return exit_status, output
                 
+        except (paramiko.SSHException, EOFError, OSError) as e:
+            logger.error(f"SSH error: {str(e)}")
+            ssh_pool.evict(builder.name)
+            return -1, str(e)
         except Exception as e:
             logger.error(f"SSH error: {str(e)}")
             return -1, str(e)
             
-    def collect_artifacts(self, task: BuildTask, build: Build, session: Session) -> List[Artifact]:
-        """Raccoglie e salva gli artifacts prodotti dalla build"""
+    def collect_artifacts(
+        self, task: BuildTask, build: Build, session: Session, build_start: float,
+        last_build_id: Optional[int]
+    ) -> List[Dict[str, Any]]:
+        """Raccoglie e salva gli artifacts prodotti dalla build (come righe della tabella artifacts)
+        
+        I file non toccati da questa build (mtime precedente a build_start) riusano
+        l'hash registrato dalla build che ha usato per ultima il working copy
+        (last_build_id), se questa è andata a buon fine.
+        """
         repo_path = self.platform_dir / task.repository_name
         artifacts = []
         
@@ -214,68 +673,227 @@ class BuildWorker:
             logger.warning(f"Unknown repository type: {task.repository_type}")
             return artifacts
             
+        # Letti una volta sola: la build è scaduta dall'ultimo commit e ogni accesso
+        # agli attributi passerebbe dall'ORM
+        build_id, build_date = build.id, build.date
+        
+        # I symlink sono economici e restano sequenziali, i file regolari vanno al pool
+        regular_files = []
         for base_dir in base_dirs:
             if not base_dir.exists():
                 continue
                 
-            for file_path in base_dir.rglob('*'):
-                if file_path.is_file():
-                    relative_path = file_path.relative_to(base_dir)
-                    
-                    if file_path.is_symlink():
-                        # Gestione symlink
-                        target = os.readlink(file_path)
-                        artifact = Artifact(
-                            build_id=build.id,
-                            build_date=build.date,
-                            filename=str(relative_path),
-                            symlink_target=target
-                        )
-                    else:
-                        # File normale - calcola hash e salva
-                        file_hash = self._hash_and_store_file(file_path)
-                        artifact = Artifact(
-                            build_id=build.id,
-                            build_date=build.date,
-                            hash=file_hash,
-                            filename=str(relative_path)
-                        )
-                    
-                    artifacts.append(artifact)
+            for entry, relative_path in walk_files(base_dir):
+                if entry.is_symlink():
+                    # Gestione symlink (solo quelli che puntano a file)
+                    if not entry.is_file():
+                        continue
+                    target = os.readlink(entry.path)
+                    artifacts.append({
+                        "build_id": build_id,
+                        "build_date": build_date,
+                        "hash": None,
+                        "filename": relative_path,
+                        "symlink_target": target
+                    })
+                elif entry.is_file(follow_symlinks=False):
+                    regular_files.append((Path(entry.path), relative_path, entry.stat(follow_symlinks=False)))
+                        
+        # File normali - calcola hash e salva in parallelo, una sola volta per inode
+        # (lo stesso file può comparire più volte tramite hardlink)
+        previous_hashes = self._previous_hashes(build, session, last_build_id)
+        unchanged_before = build_start - MTIME_SLACK
+        inode_hashes: Dict[Tuple[int, int], str] = {}
+        unique_files: Dict[Tuple[int, int], Tuple[Path, os.stat_result]] = {}
+        for file_path, relative_path, st in regular_files:
+            key = (st.st_dev, st.st_ino)
+            if key in inode_hashes or key in unique_files:
+                continue
+            previous_hash = previous_hashes.get(relative_path)
+            if (previous_hash and st.st_mtime < unchanged_before
+                    and self._stored_size(previous_hash) == st.st_size):
+                inode_hashes[key] = previous_hash
+            else:
+                unique_files[key] = (file_path, st)
+                
+        # Indice persistente stat -> hash: evita di rileggere i file invariati
+        # anche quando la build precedente non è utilizzabile
+        stat_keys = {key: stat_cache_key(st) for key, (file_path, st) in unique_files.items()}
+        cached_hashes = stat_hash_cache.get_many(stat_keys.values())
+        for key, stat_key in stat_keys.items():
+            cached_hash = cached_hashes.get(stat_key)
+            if cached_hash and self._stored_size(cached_hash) == unique_files[key][1].st_size:
+                inode_hashes[key] = cached_hash
+                del unique_files[key]
+                
+        # Per pochi file il passaggio dal pool costa più dell'hashing stesso
+        hash_map = hash_executor.map if len(unique_files) > HASH_INLINE_MAX else map
+        new_hashes = dict(zip(
+            unique_files,
+            hash_map(
+                self._hash_and_store_file,
+                [file_path for file_path, st in unique_files.values()]
+            )
+        ))
+        inode_hashes.update(new_hashes)
+        stat_hash_cache.put_many((stat_keys[key], file_hash) for key, file_hash in new_hashes.items())
+        for file_path, relative_path, st in regular_files:
+            file_hash = inode_hashes[(st.st_dev, st.st_ino)]
+            artifacts.append({
+                "build_id": build_id,
+                "build_date": build_date,
+                "hash": file_hash,
+                "filename": relative_path,
+                "symlink_target": None
+            })
                     
-        # Salva tutti gli artifacts nel database
-        session.add_all(artifacts)
-        session.commit()
+        # Salva tutti gli artifacts nel database con un unico INSERT multi-riga
+        if artifacts:
+            session.exec(
+                insert(Artifact.__table__).execution_options(insertmanyvalues_page_size=1000),
+                params=artifacts
+            )
+            session.commit()
         
         return artifacts
         
+    def _previous_hashes(self, build: Build, session: Session, last_build_id: Optional[int]) -> Dict[str, str]:
+        """Hash dei file regolari della build che ha usato per ultima il working copy
+        
+        Le build non acquisiscono il lock del repository in ordine di id: la build
+        con id precedente non è necessariamente l'ultima ad aver scritto i file.
+        Vale solo se quella build è riuscita: una build fallita nel mezzo può aver
+        modificato i file senza registrarne gli artifacts.
+        """
+        if last_build_id is None:
+            return {}
+        previous = session.get(Build, last_build_id)
+        if (not previous or previous.status != BuildStatus.SUCCESS
+                or previous.repository_id != build.repository_id
+                or previous.platform_id != build.platform_id):
+            return {}
+        
+        rows = session.exec(
+            select(Artifact.filename, Artifact.hash).where(
+                Artifact.build_id == previous.id,
+                Artifact.hash != None
+            )
+        ).all()
+        return {filename: file_hash for filename, file_hash in rows}
+        
+    def swap_last_build(self, task: BuildTask) -> Optional[int]:
+        """Registra la build corrente come ultima ad aver usato il working copy
+        
+        Restituisce l'id della build precedente, None se sconosciuto.
+        Va chiamato con il lock del repository acquisito.
+        """
+        marker_path = self.platform_dir / f"{task.repository_name}.last-build"
+        try:
+            last_build_id = int(marker_path.read_text().strip())
+        except (FileNotFoundError, ValueError):
+            last_build_id = None
+        tmp_path = marker_path.with_name(marker_path.name + ".tmp")
+        tmp_path.write_text(f"{task.build_id}\n")
+        os.replace(tmp_path, marker_path)
+        return last_build_id
+        
+    def _stored_size(self, file_hash: str) -> Optional[int]:
+        """Dimensione del file nello store, None se non presente"""
+        try:
+            return os.stat(os.path.join(STORE_BASE_DIR, file_hash[:2], file_hash[2:4], file_hash)).st_size
+        except FileNotFoundError:
+            return None
+        
     def _hash_and_store_file(self, file_path: Path) -> str:
         """Calcola l'hash SHA256 del file e lo salva nello store"""
         sha256_hash = hashlib.sha256()
         
-        with open(file_path, "rb") as f:
-            for byte_block in iter(lambda: f.read(4096), b""):
-                sha256_hash.update(byte_block)
+        with open(file_path, "rb", buffering=0) as f:
+            size = os.fstat(f.fileno()).st_size
+            if size > MMAP_MIN_SIZE:
+                # Hash in un solo passaggio sul file mappato in memoria
+                with mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ) as mm:
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                    sha256_hash.update(mm)
+            elif size:
+                # File piccoli (la maggioranza nelle librerie): una sola read costa
+                # meno di mmap + madvise + munmap
+                sha256_hash.update(os.pread(f.fileno(), size, 0))
+                    
+            file_hash = sha256_hash.hexdigest()
+            
+            # Hash già salvati da questo processo: lo store è content-addressed
+            # e non serve verificarne di nuovo la presenza sul filesystem
+            if file_hash not in _stored_hashes:
+                # Crea la struttura di directory per lo store (una volta per processo)
+                hash_dir = os.path.join(STORE_BASE_DIR, file_hash[:2], file_hash[2:4])
+                if hash_dir not in _store_dirs:
+                    os.makedirs(hash_dir, exist_ok=True)
+                    _store_dirs.add(hash_dir)
                 
-        file_hash = sha256_hash.hexdigest()
-        
-        # Crea la struttura di directory per lo store
-        hash_dir = Path(STORE_BASE_DIR) / file_hash[:2] / file_hash[2:4]
-        hash_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Salva il file se non esiste già
-        store_path = hash_dir / file_hash
-        if not store_path.exists():
-            shutil.copy2(file_path, store_path)
+                # Salva il file se non esiste già
+                store_path = Path(hash_dir, file_hash)
+                if not os.path.lexists(store_path):
+                    self._store_file(file_path, f, store_path)
+                _stored_hashes.add(file_hash)
+                
+            # Il file non servirà più: evita di tenerlo in page cache
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
             
         return file_hash
         
-    def send_notification(self, task: BuildTask, build: Build, success: bool):
-        """Invia notifica email del risultato della build"""
+    def _store_file(self, file_path: Path, src, store_path: Path):
+        """Copia il file nello store come file di sola lettura
+        
+        Niente hardlink: la voce dello store condividerebbe l'inode con il file del
+        working tree, che una build successiva può riscrivere sul posto.
+        src è il file già aperto per l'hashing: la copia lo riusa senza riaprirlo.
+        """
+        # Copia su un file temporaneo, rinominato solo a copia completa perché nessuno veda file parziali
+        fd, tmp_path = tempfile.mkstemp(dir=store_path.parent, prefix=".tmp-")
+        try:
+            os.fchmod(fd, 0o444)
+            self._copy_fd(src.fileno(), fd, os.fstat(src.fileno()).st_size)
+            os.close(fd)
+            fd = None
+            os.replace(tmp_path, store_path)
+        except BaseException:
+            if fd is not None:
+                os.close(fd)
+            os.unlink(tmp_path)
+            raise
+                
+    def _copy_fd(self, src_fd: int, dst_fd: int, size: int):
+        """Copia nel kernel: reflink (FICLONE), poi copy_file_range, altrimenti sendfile"""
+        # Su XFS/Btrfs lo store condivide i blocchi con il file sorgente senza copiarli
+        try:
+            fcntl.ioctl(dst_fd, FICLONE, src_fd)
+            return
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.ENOSYS):
+                raise
+        offset = 0
+        copy_range = getattr(os, "copy_file_range", None)
+        while offset < size and copy_range is not None:
+            try:
+                copied = copy_range(src_fd, dst_fd, size - offset, offset, offset)
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                    raise
+                break
+            if copied == 0:
+                break
+            offset += copied
+        while offset < size:
+            os.lseek(dst_fd, offset, os.SEEK_SET)
+            sent = os.sendfile(dst_fd, src_fd, offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+        
+    def send_notification(self, task: BuildTask, build: Build, success: bool, session: Session):
+        """Accoda la notifica email del risultato della build al task inau.notify.send"""
         try:
-            from smtplib import SMTP
-            from email.mime.text import MIMEText
-            
             subject = f"INAU Build {'Success' if success else 'Failed'}: {task.repository_name} {task.tag}"
             
             if success:
@@ -302,27 +920,35 @@ class BuildWorker:
             if task.user_email and '@' in task.user_email:
                 recipients.add(task.user_email)
                 
-            with Session(engine) as session:
-                # Aggiungi utenti con notifiche abilitate
-                notifiable_users = session.exec(
-                    select(User).where(User.notify == True)
-                ).all()
-                
-                for user in notifiable_users:
-                    recipients.add(f"{user.name}@{SMTP_DOMAIN}")
+            # Aggiungi utenti con notifiche abilitate
+            recipients.update(get_notifiable_recipients(session))
                     
             if recipients:
-                msg = MIMEText(body)
-                msg['Subject'] = subject
-                msg['From'] = f"{SMTP_SENDER}@{SMTP_DOMAIN}"
-                msg['To'] = ', '.join(recipients)
+                send_notification_task.delay(subject, body, sorted(recipients))
                 
-                with SMTP(SMTP_SERVER, 25) as smtp:
-                    smtp.send_message(msg)
-                    
         except Exception as e:
             logger.error(f"Failed to send notification: {str(e)}")
 
+@app.task(
+    name='inau.notify.send',
+    autoretry_for=(SMTPException, OSError),
+    retry_backoff=True,
+    max_retries=5
+)
+def send_notification_task(subject: str, body: str, recipients: List[str]):
+    """Task Celery che invia una notifica a tutti i destinatari con un solo messaggio"""
+    msg = MIMEText(body)
+    msg['Subject'] = subject
+    msg['From'] = SMTP_FROM
+    msg['To'] = ', '.join(recipients)
+    
+    try:
+        get_smtp().send_message(msg)
+    except (SMTPServerDisconnected, OSError):
+        # Il server ha chiuso la connessione inattiva: riapri e riprova una volta
+        close_smtp()
+        get_smtp().send_message(msg)
+
 @app.task(bind=True, name='inau.build.process_build')
 def process_build(self: Task, build_data: dict) -> dict:
     """Task Celery per processare una build"""
@@ -338,54 +964,80 @@ def process_build(self: Task, build_data: dict) -> dict:
             logger.error(f"Build {task.build_id} not found")
             return {"success": False, "error": "Build not found"}
             
-        build.status = BuildStatus.RUNNING
-        session.commit()
-        
-        try:
-            # Ottieni il builder per questa piattaforma
-            builder = worker.get_builder(session)
-            if not builder:
-                raise Exception(f"No builder found for platform {task.platform_id}")
-                
-            # Aggiorna il repository
-            success, message = worker.update_repository(task)
-            if not success:
-                raise Exception(f"Repository update failed: {message}")
-                
-            # Esegui la build
-            exit_status, output = worker.build_on_builder(builder, task)
-            
-            # Aggiorna il risultato della build
-            build.status = BuildStatus.SUCCESS if exit_status == 0 else BuildStatus.FAILED
-            build.output = output
-            session.commit()
+        # Un solo processo alla volta usa il working copy del repository. Con acks_late una
+        # build RUNNING può essere riconsegnata mentre è ancora in corso: se il lock è
+        # occupato la copia riconsegnata viene scartata, invece di attendere
+        lock_path = worker.platform_dir / f"{task.repository_name}.lock"
+        with path_lock(lock_path, blocking=build.status != BuildStatus.RUNNING) as locked:
+            if not locked:
+                logger.warning(f"Build {task.build_id} still running on another worker, ignoring redelivery")
+                raise Ignore()
+            session.refresh(build)
             
-            # Se la build è riuscita, raccogli gli artifacts
-            artifacts = []
-            if exit_status == 0:
-                artifacts = worker.collect_artifacts(task, build, session)
-                logger.info(f"Collected {len(artifacts)} artifacts")
+            # Con acks_late un task può essere riconsegnato: non rifare build già concluse
+            if build.status in (BuildStatus.SUCCESS, BuildStatus.FAILED, BuildStatus.CANCELLED):
+                logger.warning(f"Build {task.build_id} already completed, skipping")
+                return {"success": build.status == BuildStatus.SUCCESS, "build_id": task.build_id}
+            if build.status == BuildStatus.RUNNING:
+                # Lock libero: il worker che la eseguiva è morto (OOM, riavvio). Ripeterla
+                # potrebbe ripetere il crash all'infinito, quindi la build si chiude come fallita
+                logger.warning(f"Build {task.build_id} was interrupted, marking as failed")
+                build.status = BuildStatus.FAILED
+                build.output = "Build interrupted: worker lost"
+                session.commit()
+                worker.send_notification(task, build, False, session)
+                return {"success": False, "build_id": task.build_id, "error": build.output}
                 
-            # Invia notifica
-            worker.send_notification(task, build, exit_status == 0)
-            
-            return {
-                "success": exit_status == 0,
-                "build_id": task.build_id,
-                "exit_status": exit_status,
-                "artifacts_count": len(artifacts) if exit_status == 0 else 0
-            }
-            
-        except Exception as e:
-            logger.error(f"Build failed with error: {str(e)}")
-            build.status = BuildStatus.FAILED
-            build.output = str(e)
+            build.status = BuildStatus.RUNNING
             session.commit()
             
-            worker.send_notification(task, build, False)
-            
-            return {
-                "success": False,
-                "build_id": task.build_id,
-                "error": str(e)
-            }
+            try:
+                # Ottieni il builder per questa piattaforma
+                builder = worker.get_builder(session)
+                if not builder:
+                    raise Exception(f"No builder found for platform {task.platform_id}")
+                    
+                # Aggiorna il repository: da qui in poi i file modificati sono di questa build
+                last_build_id = worker.swap_last_build(task)
+                build_start = time.time()
+                success, message = worker.update_repository(task)
+                if not success:
+                    raise Exception(f"Repository update failed: {message}")
+                    
+                # Esegui la build
+                exit_status, output = worker.build_on_builder(builder, task)
+                
+                # Aggiorna il risultato della build
+                build.status = BuildStatus.SUCCESS if exit_status == 0 else BuildStatus.FAILED
+                build.output = output
+                session.commit()
+                
+                # Se la build è riuscita, raccogli gli artifacts
+                artifacts = []
+                if exit_status == 0:
+                    artifacts = worker.collect_artifacts(task, build, session, build_start, last_build_id)
+                    logger.info(f"Collected {len(artifacts)} artifacts")
+                    
+                # Invia notifica
+                worker.send_notification(task, build, exit_status == 0, session)
+                
+                return {
+                    "success": exit_status == 0,
+                    "build_id": task.build_id,
+                    "exit_status": exit_status,
+                    "artifacts_count": len(artifacts) if exit_status == 0 else 0
+                }
+                
+            except Exception as e:
+                logger.error(f"Build failed with error: {str(e)}")
+                build.status = BuildStatus.FAILED
+                build.output = str(e)
+                session.commit()
+                
+                worker.send_notification(task, build, False, session)
+                
+                return {
+                    "success": False,
+                    "build_id": task.build_id,
+                    "error": str(e)
+                }
@@ -1,11 +1,32 @@
 """
 INAU Models
-Definizioni delle tabelle SQLModel e Enum condivisi
+Definizioni delle tabelle SQLModel e Enum condivisi, creazione dell'engine del database
 """
+import os
 from datetime import datetime
 from typing import Optional, List
 from enum import IntEnum
-from sqlmodel import Field, SQLModel, Relationship
+from sqlalchemy.engine import Engine, make_url
+from sqlmodel import Field, SQLModel, Relationship, create_engine
+
+# Disabilita il JIT di PostgreSQL (opzionale): le query OLTP brevi non ne beneficiano
+DB_JIT_OFF = os.getenv('INAU_DB_JIT_OFF', '0') == '1'
+
+
+def create_db_engine(url: str, pool_size: int, max_overflow: int) -> Engine:
+    """Engine con pool di connessioni, usato da webhook, REST API e worker di build"""
+    connect_args = {}
+    if DB_JIT_OFF and make_url(url).get_backend_name() == "postgresql":
+        connect_args['options'] = '-c jit=off'
+    return create_engine(
+        url,
+        echo=False,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_pre_ping=True,
+        pool_recycle=1800,
+        connect_args=connect_args
+    )
 
 
 # Enum per i tipi
@@ -159,6 +180,7 @@ class Builder(SQLModel, table=True):
     platform_id: int = Field(foreign_key="platforms.id", index=True)
     name: str = Field(max_length=255)
     environment: Optional[str] = Field(default=None, max_length=255)
+    jobs: int = Field(default=0, description="Job paralleli di make (0 = CPU online del builder)")
     
     # Relationships
     platform: Platform = Relationship(back_populates="builders")
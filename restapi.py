@@ -4,40 +4,58 @@ Fornisce API RESTful per consultare builds, artifacts e installare binari
 """
 import os
 import logging
+import time
+import threading
+import queue
 from datetime import datetime
 from typing import Optional, List, Dict, Any, Union
 from pathlib import Path
 import base64
+import shlex
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 from enum import IntEnum
 
 from fastapi import FastAPI, HTTPException, Depends, Header, Query, Response
 from fastapi.responses import JSONResponse, PlainTextResponse
-from sqlmodel import Session, create_engine, select, func, and_, or_, SQLModel, selectinload
+from fastapi.concurrency import run_in_threadpool
+from sqlmodel import Session, select, func, and_, or_, SQLModel
+from sqlalchemy.orm import joinedload
 from pydantic import BaseModel, Field, validator
 import paramiko
 import ldap
-from smtplib import SMTP
+from smtplib import SMTP, SMTPException, SMTPServerDisconnected
 from email.mime.text import MIMEText
 
 # Import dei modelli dal models.py
 from models import (
     Architecture, Distribution, Platform, Provider, Repository,
     Build, Artifact, Builder, Server, Facility, Host, User, Installation,
-    RepositoryType, BuildStatus, InstallationType, AuthenticationType
+    RepositoryType, BuildStatus, InstallationType, AuthenticationType,
+    create_db_engine
 )
 
 # Configurazione
 DATABASE_URL = os.getenv('DATABASE_URL', None)
 LDAP_URL = os.getenv('LDAP_URL', None)
+LDAP_POOL_SIZE = int(os.getenv('INAU_LDAP_POOL_SIZE', 8))
 SMTP_SERVER = os.getenv('SMTP_SERVER', None)
 SMTP_DOMAIN = os.getenv('SMTP_DOMAIN', None)
 SMTP_SENDER = os.getenv('SMTP_SENDER', None)
+SMTP_FROM = f"{SMTP_SENDER}@{SMTP_DOMAIN}"
+SMTP_IDLE_TIMEOUT = int(os.getenv('INAU_SMTP_IDLE_TIMEOUT', 60))  # Secondi prima di chiudere la connessione inattiva
 REPO_DIR = os.getenv('INAU_REPO_DIR', None)
 STORE_DIR = os.getenv('INAU_STORE_DIR', None)
+NOTIFY_CACHE_TTL = int(os.getenv('INAU_NOTIFY_CACHE_TTL', 300))
+USER_CACHE_TTL = int(os.getenv('INAU_USER_CACHE_TTL', 60))
+USER_CACHE_SIZE = 1024
+SFTP_UPLOAD_WORKERS = int(os.getenv('INAU_SFTP_UPLOAD_WORKERS', 4))
 
 # Setup database
-engine = create_engine(DATABASE_URL, echo=False)
+DB_POOL_SIZE = int(os.getenv('INAU_DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.getenv('INAU_DB_MAX_OVERFLOW', 20))
+engine = create_db_engine(DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW)
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -78,6 +96,7 @@ class BuilderRequest(BaseModel):
     version: str
     architecture: str
     environment: Optional[str] = None
+    jobs: int = Field(0, ge=0)
 
 class BuilderResponse(BaseModel):
     name: str
@@ -85,6 +104,7 @@ class BuilderResponse(BaseModel):
     version: str
     architecture: str
     environment: Optional[str]
+    jobs: int
 
 class ServerRequest(BaseModel):
     name: str = Field(..., min_length=1, max_length=255)
@@ -170,8 +190,17 @@ async def lifespan(app: FastAPI):
     """Gestione del ciclo di vita dell'applicazione"""
     logger.info("Starting INAU REST API...")
     SQLModel.metadata.create_all(engine)
+    email_thread = threading.Thread(target=_email_sender, name="inau-email", daemon=True)
+    email_thread.start()
     yield
     logger.info("Shutting down INAU REST API...")
+    # Svuota la coda delle email prima di chiudere la connessione
+    _email_queue.put(None)
+    email_thread.join(timeout=30)
+    with _smtp_lock:
+        _close_smtp()
+    ldap_pool.close_all()
+    ssh_pool.close_all()
 
 app = FastAPI(
     title="INAU REST API",
@@ -184,6 +213,161 @@ def get_session():
     with Session(engine) as session:
         yield session
 
+class LDAPPool:
+    """Pool di connessioni LDAP già aperte (TCP+TLS), riusate tra le autenticazioni
+    
+    Ogni connessione è data in uso esclusivo a una richiesta: il bind dell'utente
+    la riassocia alle sue credenziali e poi torna nel pool.
+    """
+    
+    def __init__(self, url: str, max_pool_size: int = 8, timeout: int = 10):
+        self.url = url
+        self.timeout = timeout
+        self._idle: "queue.Queue[ldap.ldapobject.LDAPObject]" = queue.Queue(maxsize=max_pool_size)
+        
+    def _connect(self) -> "ldap.ldapobject.LDAPObject":
+        conn = ldap.initialize(self.url, bytes_mode=False)
+        conn.set_option(ldap.OPT_NETWORK_TIMEOUT, self.timeout)
+        conn.set_option(ldap.OPT_TIMEOUT, self.timeout)
+        return conn
+        
+    def _discard(self, conn: "ldap.ldapobject.LDAPObject"):
+        try:
+            conn.unbind_s()
+        except ldap.LDAPError:
+            pass
+            
+    def _release(self, conn: "ldap.ldapobject.LDAPObject"):
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            self._discard(conn)
+            
+    def _bind_once(self, conn: "ldap.ldapobject.LDAPObject", dn: str, password: str):
+        """Bind su conn, che poi torna nel pool o viene chiusa a seconda dell'esito"""
+        try:
+            conn.simple_bind_s(dn, password)
+        except ldap.INVALID_CREDENTIALS:
+            # La connessione resta valida, solo il bind è fallito
+            self._release(conn)
+            raise
+        except ldap.LDAPError:
+            self._discard(conn)
+            raise
+        self._release(conn)
+        
+    def bind(self, dn: str, password: str):
+        """Verifica le credenziali con un bind; solleva ldap.LDAPError se non valide"""
+        try:
+            conn = self._idle.get_nowait()
+            reused = True
+        except queue.Empty:
+            conn = self._connect()
+            reused = False
+        try:
+            self._bind_once(conn, dn, password)
+        except ldap.SERVER_DOWN:
+            # Connessione in pool chiusa dal server (già scartata): una sola nuova prova
+            if not reused:
+                raise
+            self._bind_once(self._connect(), dn, password)
+            
+    def close_all(self):
+        """Chiude le connessioni inattive"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+ldap_pool = LDAPPool(LDAP_URL, LDAP_POOL_SIZE)
+
+class SSHClientPool:
+    """Client SSH verso i server di installazione, riusati per (host, utente)"""
+    
+    def __init__(self, key_filename: str, keepalive: int = 30):
+        self.key_filename = key_filename
+        self.keepalive = keepalive
+        self._clients: Dict[tuple, paramiko.SSHClient] = {}
+        self._lock = threading.Lock()
+        
+    def acquire(self, host: str, username: str) -> paramiko.SSHClient:
+        """Restituisce un client connesso, riaprendolo se la connessione è caduta"""
+        key = (host, username)
+        with self._lock:
+            client = self._clients.get(key)
+            transport = client.get_transport() if client is not None else None
+            if transport is not None and transport.is_active():
+                return client
+            if client is not None:
+                client.close()
+                
+            client = paramiko.SSHClient()
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            client.connect(
+                hostname=host,
+                port=22,
+                username=username,
+                key_filename=self.key_filename
+            )
+            client.get_transport().set_keepalive(self.keepalive)
+            self._clients[key] = client
+            return client
+            
+    def run_script(self, client: paramiko.SSHClient, script: List[str]) -> tuple:
+        """Esegue lo script con sh -s su un solo canale; restituisce (exit status, output)"""
+        with client.get_transport().open_session() as chan:
+            chan.set_combine_stderr(True)
+            chan.exec_command("sh -s")
+            chan.sendall(("\n".join(script) + "\n").encode())
+            chan.shutdown_write()
+            output = chan.makefile('rb').read()
+            exit_status = chan.recv_exit_status()
+        return exit_status, output[-4096:].decode('utf-8', errors='replace')
+        
+    def evict(self, host: str, username: str):
+        """Chiude e rimuove dal pool il client verso l'host"""
+        with self._lock:
+            client = self._clients.pop((host, username), None)
+        if client is not None:
+            client.close()
+            
+    def close_all(self):
+        """Chiude tutti i client del pool"""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            client.close()
+
+ssh_pool = SSHClientPool(os.path.expanduser("~/.ssh/id_rsa"))
+
+# Utenti abilitati: username -> (istante di caricamento, (id, admin)), None se assente
+_user_cache: Dict[str, tuple] = {}
+_user_cache_lock = threading.Lock()
+
+def get_user_flags(session: Session, username: str) -> Optional[tuple]:
+    """(id, admin) dell'utente, ricaricati dal database al più ogni USER_CACHE_TTL secondi"""
+    now = time.monotonic()
+    with _user_cache_lock:
+        cached = _user_cache.get(username)
+    if cached is not None and now - cached[0] <= USER_CACHE_TTL:
+        return cached[1]
+    row = session.exec(select(User.id, User.admin).where(User.name == username)).first()
+    flags = tuple(row) if row else None
+    with _user_cache_lock:
+        # Limite grossolano alla crescita: gli username arrivano dai client
+        if len(_user_cache) >= USER_CACHE_SIZE:
+            _user_cache.clear()
+        _user_cache[username] = (now, flags)
+    return flags
+
+def invalidate_user(username: str):
+    """Da chiamare quando un utente viene creato, modificato o eliminato"""
+    with _user_cache_lock:
+        _user_cache.pop(username, None)
+
 # Dependency per l'autenticazione
 async def authenticate(
     auth_type: AuthenticationType = AuthenticationType.USER,
@@ -204,19 +388,20 @@ async def authenticate(
         username, password = decoded.split(':', 1)
         
         # Verifica che l'utente esista nel database
-        user = session.exec(select(User).where(User.name == username)).first()
+        user = get_user_flags(session, username)
         if not user:
             raise HTTPException(status_code=403, detail="User not enabled")
         
         # Se richiesto admin, verifica i permessi
-        if auth_type == AuthenticationType.ADMIN and not user.admin:
+        if auth_type == AuthenticationType.ADMIN and not user[1]:
             raise HTTPException(status_code=403, detail="Admin privileges required")
         
         # Autenticazione LDAP
         try:
-            auth = ldap.initialize(LDAP_URL, bytes_mode=False)
-            auth.simple_bind_s(f"uid={username},ou=people,dc=elettra,dc=eu", password)
-            auth.unbind_s()
+            # Bind bloccante: eseguito nel threadpool per non fermare l'event loop
+            await run_in_threadpool(
+                ldap_pool.bind, f"uid={username},ou=people,dc=elettra,dc=eu", password
+            )
         except Exception as e:
             logger.error(f"LDAP authentication failed: {str(e)}")
             raise HTTPException(status_code=403, detail="Authentication failed")
@@ -231,6 +416,34 @@ async def authenticate(
 
 # Funzioni di utilità
 
+# Connessione SMTP del processo, condivisa tra le richieste e protetta da lock
+_smtp: Optional[SMTP] = None
+_smtp_lock = threading.Lock()
+_email_queue: "queue.Queue[Optional[MIMEText]]" = queue.Queue()
+
+def _close_smtp():
+    """Chiude la connessione SMTP condivisa (chiamare con _smtp_lock acquisito)"""
+    global _smtp
+    if _smtp is not None:
+        try:
+            _smtp.quit()
+        except (SMTPException, OSError):
+            _smtp.close()
+        _smtp = None
+
+def _smtp_send(msg: MIMEText):
+    """Invia sulla connessione condivisa, riaprendola una volta se il server l'ha chiusa"""
+    global _smtp
+    with _smtp_lock:
+        try:
+            if _smtp is None:
+                _smtp = SMTP(SMTP_SERVER, 25)
+            _smtp.send_message(msg)
+        except (SMTPServerDisconnected, OSError):
+            _close_smtp()
+            _smtp = SMTP(SMTP_SERVER, 25)
+            _smtp.send_message(msg)
+
 def send_email(recipients: List[str], subject: str, body: str):
     """Invia email di notifica"""
     try:
@@ -239,20 +452,50 @@ def send_email(recipients: List[str], subject: str, body: str):
             
         msg = MIMEText(body)
         msg['Subject'] = f"INAU. {subject}"
-        msg['From'] = f"{SMTP_SENDER}@{SMTP_DOMAIN}"
+        msg['From'] = SMTP_FROM
         msg['To'] = ', '.join(recipients)
         
-        with SMTP(SMTP_SERVER, 25) as smtp:
-            smtp.send_message(msg)
+        # L'invio avviene nel thread dedicato: la richiesta non attende il server SMTP
+        _email_queue.put(msg)
             
     except Exception as e:
         logger.error(f"Failed to send email: {str(e)}")
 
+def _email_sender():
+    """Thread che invia in ordine le email accodate, sulla connessione condivisa"""
+    while True:
+        try:
+            msg = _email_queue.get(timeout=SMTP_IDLE_TIMEOUT)
+        except queue.Empty:
+            # Nessuna email in arrivo: chiude la connessione prima che lo faccia il server
+            with _smtp_lock:
+                _close_smtp()
+            continue
+        if msg is None:
+            break
+        try:
+            _smtp_send(msg)
+        except Exception as e:
+            logger.error(f"Failed to send email: {str(e)}")
+
+_admin_cache: Dict[str, Any] = {"time": None, "recipients": []}
+
+def get_admin_recipients(session: Session) -> List[str]:
+    """Indirizzi degli amministratori, ricaricati al più ogni NOTIFY_CACHE_TTL secondi"""
+    now = time.monotonic()
+    if _admin_cache["time"] is None or now - _admin_cache["time"] > NOTIFY_CACHE_TTL:
+        names = session.exec(select(User.name).where(User.admin == True)).all()
+        _admin_cache["recipients"] = [f"{name}@{SMTP_DOMAIN}" for name in names]
+        _admin_cache["time"] = now
+    return _admin_cache["recipients"]
+
+def invalidate_admin_recipients():
+    """Da chiamare quando gli utenti cambiano"""
+    _admin_cache["time"] = None
+
 def send_email_admins(subject: str, body: str, session: Session):
     """Invia email agli amministratori"""
-    admins = session.exec(select(User).where(User.admin == True)).all()
-    recipients = [f"{admin.name}@{SMTP_DOMAIN}" for admin in admins]
-    send_email(recipients, subject, body)
+    send_email(get_admin_recipients(session), subject, body)
 
 def format_plain_text_response(data: Union[Dict[str, Any], List[Dict[str, Any]]]) -> str:
     """Formatta la risposta in plain text con colonne allineate"""
@@ -265,28 +508,30 @@ def format_plain_text_response(data: Union[Dict[str, Any], List[Dict[str, Any]]]
     if not data:
         return ""
     
-    # Calcola larghezza massima per ogni colonna
-    col_widths = {}
+    # Converte ogni cella in stringa una sola volta, calcolando insieme le larghezze
+    col_widths: Dict[str, int] = {}
+    rows = []
     for item in data:
+        cells = []
         for key, value in item.items():
-            max_width = max(len(str(key)), len(str(value)))
-            col_widths[key] = max(col_widths.get(key, 0), max_width)
-    
-    # Costruisci l'output
-    lines = []
-    
-    # Header
-    header = "  ".join(key.ljust(col_widths[key]) for key in data[0].keys())
-    lines.append(header)
-    
-    # Separator
-    separator = "--".join("-" * col_widths[key] for key in data[0].keys())
-    lines.append(separator)
-    
-    # Rows
-    for item in data:
-        row = "  ".join(str(item[key]).ljust(col_widths[key]) for key in item.keys())
-        lines.append(row)
+            text = str(value)
+            cells.append((key, text))
+            # Ogni colonna parte dalla larghezza dell'intestazione, anche se le celle sono vuote
+            width = len(text)
+            if width > col_widths.setdefault(key, len(str(key))):
+                col_widths[key] = width
+        rows.append(cells)
+    
+    # Costruisci l'output: header, separatore e righe
+    keys = list(data[0].keys())
+    lines = [
+        "  ".join(key.ljust(col_widths[key]) for key in keys),
+        "--".join("-" * col_widths[key] for key in keys)
+    ]
+    lines.extend(
+        "  ".join(text.ljust(col_widths[key]) for key, text in cells)
+        for cells in rows
+    )
     
     return "\n".join(lines)
 
@@ -362,6 +607,7 @@ async def create_user(
     
     try:
         session.commit()
+        invalidate_user(user.name)
         session.refresh(db_user)
         return db_user
     except Exception as e:
@@ -382,6 +628,9 @@ async def update_user(
     
     db_user.name = user.name
     session.commit()
+    invalidate_admin_recipients()
+    invalidate_user(username)
+    invalidate_user(user.name)
     session.refresh(db_user)
     return db_user
 
@@ -398,6 +647,8 @@ async def delete_user(
     
     session.delete(db_user)
     session.commit()
+    invalidate_admin_recipients()
+    invalidate_user(username)
 
 # Endpoints Architectures
 
@@ -479,8 +730,8 @@ async def get_platforms(
     platforms = session.exec(
         select(Platform)
         .options(
-            selectinload(Platform.distribution),
-            selectinload(Platform.architecture)
+            joinedload(Platform.distribution),
+            joinedload(Platform.architecture)
         )
     ).all()
     
@@ -548,10 +799,10 @@ async def get_builders(
     builders = session.exec(
         select(Builder)
         .options(
-            selectinload(Builder.platform)
-            .selectinload(Platform.distribution),
-            selectinload(Builder.platform)
-            .selectinload(Platform.architecture)
+            joinedload(Builder.platform)
+            .joinedload(Platform.distribution),
+            joinedload(Builder.platform)
+            .joinedload(Platform.architecture)
         )
     ).all()
     
@@ -562,7 +813,8 @@ async def get_builders(
             "distribution": b.platform.distribution.name,
             "version": b.platform.distribution.version,
             "architecture": b.platform.architecture.name,
-            "environment": b.environment
+            "environment": b.environment,
+            "jobs": b.jobs
         })
     
     if "text/plain" in accept:
@@ -611,7 +863,8 @@ async def create_builder(
     db_builder = Builder(
         name=builder.name,
         platform_id=platform.id,
-        environment=builder.environment
+        environment=builder.environment,
+        jobs=builder.jobs
     )
     session.add(db_builder)
     
@@ -623,7 +876,8 @@ async def create_builder(
             "distribution": dist.name,
             "version": dist.version,
             "architecture": arch.name,
-            "environment": db_builder.environment
+            "environment": db_builder.environment,
+            "jobs": db_builder.jobs
         }
     except Exception:
         session.rollback()
@@ -682,7 +936,7 @@ async def get_hosts(
     hosts = session.exec(
         select(Host)
         .where(Host.facility_id == facility.id)
-        .options(selectinload(Host.server))
+        .options(joinedload(Host.server))
     ).all()
     
     data = []
@@ -758,11 +1012,11 @@ async def get_builds(
 ):
     """Lista le builds con filtri opzionali"""
     query = select(Build).options(
-        selectinload(Build.repository),
-        selectinload(Build.platform)
-        .selectinload(Platform.distribution),
-        selectinload(Build.platform)
-        .selectinload(Platform.architecture)
+        joinedload(Build.repository),
+        joinedload(Build.platform)
+        .joinedload(Platform.distribution),
+        joinedload(Build.platform)
+        .joinedload(Platform.architecture)
     )
     
     # Applica filtri
@@ -814,10 +1068,7 @@ async def get_build(
     build = session.exec(
         select(Build)
         .where(Build.id == build_id)
-        .options(
-            selectinload(Build.repository),
-            selectinload(Build.platform)
-        )
+        .options(joinedload(Build.repository))
     ).first()
     
     if not build:
@@ -875,11 +1126,11 @@ async def get_repositories(
 ):
     """Lista tutti i repository con filtri opzionali"""
     query = select(Repository).options(
-        selectinload(Repository.provider),
-        selectinload(Repository.platform)
-        .selectinload(Platform.distribution),
-        selectinload(Repository.platform)
-        .selectinload(Platform.architecture)
+        joinedload(Repository.provider),
+        joinedload(Repository.platform)
+        .joinedload(Platform.distribution),
+        joinedload(Repository.platform)
+        .joinedload(Platform.architecture)
     )
     
     if enabled is not None:
@@ -992,6 +1243,22 @@ async def create_repository(
 
 # Endpoints Installations
 
+def upload_files(ssh: paramiko.SSHClient, uploads: Dict[str, Path]):
+    """Carica i file dello store sul server in parallelo"""
+    items = list(uploads.items())
+    workers = max(1, min(SFTP_UPLOAD_WORKERS, len(items)))
+    
+    def worker(chunk):
+        # Un client SFTP per thread, tutti sullo stesso transport SSH
+        with ssh.open_sftp() as sftp:
+            for remote_path, local_path in chunk:
+                sftp.put(str(local_path), remote_path, confirm=False)
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(worker, items[i::workers]) for i in range(workers)]
+        for future in futures:
+            future.result()
+
 def install(
     username: str,
     reponame: str,
@@ -1038,64 +1305,85 @@ def install(
             )
         
         try:
-            # Connessione SSH al server
-            with paramiko.SSHClient() as ssh:
-                ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                ssh.connect(
-                    hostname=server.name,
-                    port=22,
-                    username="root",
-                    key_filename=os.path.expanduser("~/.ssh/id_rsa")
-                )
-                
-                with ssh.open_sftp() as sftp:
-                    # Installa gli artifacts
-                    artifacts = session.exec(
-                        select(Artifact).where(Artifact.build_id == build.id)
-                    ).all()
+            # Connessione SSH al server, riusata tra le installazioni
+            ssh = ssh_pool.acquire(server.name, "root")
+            
+            # Comandi raccolti in un unico script, eseguito su un solo canale
+            script = []
+            links = []
+            uploads = {}
+            # Installa gli artifacts
+            artifacts = session.exec(
+                select(Artifact).where(Artifact.build_id == build.id)
+            ).all()
+            
+            for artifact in artifacts:
+                if artifact.hash:
+                    # File normale: ogni hash viene caricato una sola volta
+                    uploads[artifact.hash] = Path(STORE_DIR) / artifact.hash[:2] / artifact.hash[2:4] / artifact.hash
+                    
+                    # Determina permessi
+                    filemode = "755"
+                    if repository.type == RepositoryType.CONFIGURATION:
+                        filemode = "644"
+                    
+                    # Installa il file
+                    if itype == InstallationType.GLOBAL or itype == InstallationType.FACILITY:
+                        dest_path = f"{server.prefix}{repository.destination}{artifact.filename}"
+                    else:  # HOST
+                        dest_path = f"{server.prefix}/site/{hosts[0].name}/{repository.destination}{artifact.filename}"
                     
-                    for artifact in artifacts:
-                        if artifact.hash:
-                            # File normale
-                            hash_path = Path(STORE_DIR) / artifact.hash[:2] / artifact.hash[2:4] / artifact.hash
-                            temp_path = f"/tmp/{artifact.hash}"
-                            
-                            # Copia il file
-                            sftp.put(str(hash_path), temp_path)
-                            
-                            # Determina permessi
-                            filemode = "755"
-                            if repository.type == RepositoryType.CONFIGURATION:
-                                filemode = "644"
-                            
-                            # Installa il file
-                            if itype == InstallationType.GLOBAL or itype == InstallationType.FACILITY:
-                                dest_path = f"{server.prefix}{repository.destination}{artifact.filename}"
-                            else:  # HOST
-                                dest_path = f"{server.prefix}/site/{hosts[0].name}/{repository.destination}{artifact.filename}"
-                            
-                            # Crea directory e installa
-                            ssh.exec_command(f"mkdir -p $(dirname {dest_path})")
-                            ssh.exec_command(f"install -m{filemode} {temp_path} {dest_path}")
-                            ssh.exec_command(f"rm {temp_path}")
-                        else:
-                            # Symlink
-                            if itype == InstallationType.GLOBAL or itype == InstallationType.FACILITY:
-                                link_path = f"{server.prefix}{artifact.filename}"
-                                target_path = f"{server.prefix}{artifact.symlink_target}"
-                            else:  # HOST
-                                link_path = f"{server.prefix}/site/{hosts[0].name}/{artifact.filename}"
-                                target_path = f"{server.prefix}/site/{hosts[0].name}/{artifact.symlink_target}"
-                            
-                            ssh.exec_command(f"ln -sfn {target_path} {link_path}")
+                    # Crea directory e installa: righe separate, perché set -e ignora
+                    # il fallimento dei comandi non finali di una lista &&
+                    script.append(f"mkdir -p {shlex.quote(posixpath.dirname(dest_path))}")
+                    script.append(f"install -m{filemode} \"$tmpdir\"/{artifact.hash} {shlex.quote(dest_path)}")
+                else:
+                    # Symlink
+                    if itype == InstallationType.GLOBAL or itype == InstallationType.FACILITY:
+                        link_path = f"{server.prefix}{artifact.filename}"
+                        target_path = f"{server.prefix}{artifact.symlink_target}"
+                    else:  # HOST
+                        link_path = f"{server.prefix}/site/{hosts[0].name}/{artifact.filename}"
+                        target_path = f"{server.prefix}/site/{hosts[0].name}/{artifact.symlink_target}"
+                    
+                    links.append(f"mkdir -p {shlex.quote(posixpath.dirname(link_path))}")
+                    links.append(f"ln -sfn {shlex.quote(target_path)} {shlex.quote(link_path)}")
+            
+            # I symlink dopo i file, ciascuno preceduto dalla creazione della sua directory
+            script.extend(links)
+            
+            # I file viaggiano in una directory privata (0700) di questa installazione:
+            # /tmp è scrivibile da tutti e gli hash degli artifacts sono pubblici
+            if uploads:
+                exit_status, output = ssh_pool.run_script(ssh, ["mktemp -d /tmp/inau.XXXXXXXXXX"])
+                tmpdir = output.strip()
+                if exit_status != 0 or not tmpdir.startswith("/tmp/inau."):
+                    raise Exception(f"Cannot create temporary directory on {server.name}: {output}")
+                try:
+                    upload_files(ssh, {f"{tmpdir}/{file_hash}": path for file_hash, path in uploads.items()})
+                except Exception:
+                    try:
+                        ssh_pool.run_script(ssh, [f"rm -rf {shlex.quote(tmpdir)}"])
+                    except (paramiko.SSHException, EOFError, OSError):
+                        pass
+                    raise
+                # La directory viene rimossa all'uscita dello script, anche in caso di errore
+                script[:0] = [f"tmpdir={shlex.quote(tmpdir)}", "trap 'rm -rf \"$tmpdir\"' EXIT"]
+            script.insert(0, "set -e")
+            
+            exit_status, output = ssh_pool.run_script(ssh, script)
+            if exit_status != 0:
+                raise Exception(f"Install script failed on {server.name} ({exit_status}): {output}")
         
         except Exception as e:
             logger.error(f"Installation error: {str(e)}")
+            if isinstance(e, (paramiko.SSHException, EOFError, OSError)):
+                ssh_pool.evict(server.name, "root")
             raise HTTPException(status_code=500, detail=str(e))
         
-        # Registra le installazioni
-        for host in hosts:
-            installation = Installation(
+        # Registra le installazioni: aggiunte in blocco, un solo commit alla fine
+        session.add_all([
+            Installation(
                 user_id=user.id,
                 host_id=host.id,
                 build_id=build.id,
@@ -1104,18 +1392,25 @@ def install(
                 install_date=now,
                 valid_from=now
             )
-            session.add(installation)
-            
-            retval.append({
+            for host in hosts
+        ])
+        retval.extend(
+            {
                 'facility': host.facility.name,
                 'host': host.name,
                 'repository': repository.name,
                 'tag': build.tag,
-                'date': installation.install_date,
+                'date': now,
                 'author': user.name
-            })
+            }
+            for host in hosts
+        )
     
-    session.commit()
+    try:
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
     
     # Invia notifiche
     subject = f"Installation: {reponame} {tag}"
@@ -1151,11 +1446,11 @@ async def get_installations(
     )
     
     query = select(Installation).options(
-        selectinload(Installation.user),
-        selectinload(Installation.host)
-        .selectinload(Host.facility),
-        selectinload(Installation.build)
-        .selectinload(Build.repository)
+        joinedload(Installation.user),
+        joinedload(Installation.host)
+        .joinedload(Host.facility),
+        joinedload(Installation.build)
+        .joinedload(Build.repository)
     )
     
     if mode == "status":
@@ -1216,7 +1511,7 @@ async def create_global_installation(
             hosts = session.exec(
                 select(Host)
                 .where(Host.server_id == server.id)
-                .options(selectinload(Host.facility))
+                .options(joinedload(Host.facility))
             ).all()
             if hosts:
                 destinations[server] = hosts
@@ -1256,10 +1551,10 @@ async def get_facility_installations(
     )
     
     query = select(Installation).options(
-        selectinload(Installation.user),
-        selectinload(Installation.host),
-        selectinload(Installation.build)
-        .selectinload(Build.repository)
+        joinedload(Installation.user),
+        joinedload(Installation.host),
+        joinedload(Installation.build)
+        .joinedload(Build.repository)
     ).join(Host, Installation.host_id == Host.id)
     
     if mode == "status":
@@ -1331,7 +1626,7 @@ async def create_facility_installation(
                     Host.server_id == server.id,
                     Host.facility_id == facility.id
                 )
-                .options(selectinload(Host.facility))
+                .options(joinedload(Host.facility))
             ).all()
             if hosts:
                 destinations[server] = hosts
@@ -1376,9 +1671,9 @@ async def get_host_installations(
     )
     
     query = select(Installation).options(
-        selectinload(Installation.user),
-        selectinload(Installation.build)
-        .selectinload(Build.repository)
+        joinedload(Installation.user),
+        joinedload(Installation.build)
+        .joinedload(Build.repository)
     ).where(Installation.host_id == host.id)
     
     if mode == "status":
@@ -1426,8 +1721,8 @@ async def create_host_installation(
             Host.name == host_name
         )
         .options(
-            selectinload(Host.facility),
-            selectinload(Host.server)
+            joinedload(Host.facility),
+            joinedload(Host.server)
         )
     ).first()
     if not host:
@@ -1489,10 +1784,10 @@ async def get_servers(
     servers = session.exec(
         select(Server)
         .options(
-            selectinload(Server.platform)
-            .selectinload(Platform.distribution),
-            selectinload(Server.platform)
-            .selectinload(Platform.architecture)
+            joinedload(Server.platform)
+            .joinedload(Platform.distribution),
+            joinedload(Server.platform)
+            .joinedload(Platform.architecture)
         )
     ).all()
     
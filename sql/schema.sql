@@ -69,6 +69,8 @@ CREATE INDEX "repositories_platform_id_idx" ON "repositories" ("platform_id");
 CREATE INDEX "repositories_name_idx" ON "repositories" ("name");
 CREATE INDEX "repositories_provider_platform_idx" ON "repositories" ("provider_id", "platform_id");
 CREATE INDEX "repositories_enabled_idx" ON "repositories" ("enabled") WHERE "enabled" = TRUE;
+-- Lookup del webhook: repository abilitati per nome
+CREATE INDEX "repositories_name_enabled_idx" ON "repositories" ("name") WHERE "enabled" = TRUE;
 
 --
 -- Table structure for table "builds" (with partitioning)
@@ -227,6 +229,21 @@ CREATE TABLE "servers" (
 );
 CREATE INDEX "servers_platform_id_idx" ON "servers" ("platform_id");
 
+--
+-- Table structure for table "builders"
+--
+
+DROP TABLE IF EXISTS "builders" CASCADE;
+CREATE TABLE "builders" (
+  "id" SERIAL PRIMARY KEY,
+  "platform_id" INTEGER NOT NULL,
+  "name" VARCHAR(255) NOT NULL,
+  "environment" VARCHAR(255),
+  "jobs" INTEGER NOT NULL DEFAULT 0,
+  FOREIGN KEY ("platform_id") REFERENCES "platforms" ("id")
+);
+CREATE INDEX "builders_platform_id_idx" ON "builders" ("platform_id");
+
 --
 -- Table structure for table "facilities"
 --
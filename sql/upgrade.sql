@@ -0,0 +1,10 @@
+--
+-- Aggiornamento di un database esistente allo schema corrente
+-- Idempotente: può essere eseguito più volte (schema.sql invece ricrea le tabelle da zero)
+--
+
+-- Job paralleli di make per builder (0 = CPU online del builder)
+ALTER TABLE "builders" ADD COLUMN IF NOT EXISTS "jobs" INTEGER NOT NULL DEFAULT 0;
+
+-- Lookup del webhook: repository abilitati per nome
+CREATE INDEX IF NOT EXISTS "repositories_name_enabled_idx" ON "repositories" ("name") WHERE "enabled" = TRUE;
@@ -3,22 +3,26 @@ INAU Webhook Handler
 Gestisce i webhook da GitLab per trigger di nuove build su tag annotati
 """
 from datetime import datetime
-from typing import Optional, List
-from pydantic import BaseModel, ConfigDict
-from sqlmodel import SQLModel, Session, create_engine, select
-from fastapi import FastAPI, HTTPException, Depends
+from typing import Optional, List, Dict, Tuple
+from pydantic import BaseModel, ConfigDict, ValidationError
+from sqlmodel import SQLModel, Session, select
+from sqlalchemy import bindparam, func
+from fastapi import FastAPI, HTTPException, Depends, Header, Request
 from fastapi.responses import JSONResponse
 import logging
 import json
 from contextlib import asynccontextmanager
 import os
+import time
+import anyio
 from celery import Celery
 
 # Import dei modelli condivisi
 from models import (
     Architecture, Distribution, Platform, Provider, Repository,
     Build, Artifact, Builder, Server, Facility, Host, User, Installation,
-    RepositoryType, BuildStatus, InstallationType
+    RepositoryType, BuildStatus, InstallationType,
+    create_db_engine
 )
 
 # Configurazione logging
@@ -27,7 +31,10 @@ logger = logging.getLogger(__name__)
 
 # Configurazione database
 DATABASE_URL = os.getenv('DATABASE_URL', None)
-engine = create_engine(DATABASE_URL, echo=False)
+DB_POOL_SIZE = int(os.getenv('INAU_DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.getenv('INAU_DB_MAX_OVERFLOW', 20))
+REPO_CACHE_TTL = int(os.getenv('INAU_REPO_CACHE_TTL', 60))
+engine = create_db_engine(DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW)
 
 # Setup Celery
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', None)
@@ -104,6 +111,9 @@ async def lifespan(app: FastAPI):
     # Startup
     logger.info("Starting INAU Webhook Handler...")
     SQLModel.metadata.create_all(engine)
+    # Gli endpoint sincroni girano nel threadpool di AnyIO: un thread per ogni
+    # connessione del pool, così nessuna richiesta resta ferma ad aspettarne una
+    anyio.to_thread.current_default_thread_limiter().total_tokens = DB_POOL_SIZE + DB_MAX_OVERFLOW
     yield
     # Shutdown
     logger.info("Shutting down INAU Webhook Handler...")
@@ -116,25 +126,48 @@ app = FastAPI(
 
 # Dependency per ottenere la sessione del database
 def get_session():
-    with Session(engine) as session:
+    # Senza expire_on_commit le build appena create restano leggibili senza ricaricarle
+    with Session(engine, expire_on_commit=False) as session:
         yield session
 
 # Funzioni di utilità
 
+TAG_REF_PREFIX = "refs/tags/"
+NULL_SHA = "0" * 40
+# Header X-Gitlab-Event che possono portare un tag push: i system hook di istanza
+# inviano "System Hook" per tutti gli eventi e vanno distinti con object_kind
+TAG_PUSH_EVENTS = ("Tag Push Hook", "System Hook")
+MAX_PAYLOAD_SIZE = int(os.getenv('INAU_WEBHOOK_MAX_PAYLOAD', 1 << 20))
+
 def extract_tag_from_ref(ref: str) -> Optional[str]:
     """Estrae il nome del tag dal ref GitLab"""
-    if ref.startswith("refs/tags/"):
-        return ref.replace("refs/tags/", "")
+    if ref.startswith(TAG_REF_PREFIX):
+        return ref[len(TAG_REF_PREFIX):]
     return None
 
+# Statement costruito una sola volta: a ogni webhook cambia solo il parametro
+FIND_REPOSITORIES_STMT = select(Repository).where(
+    Repository.name == bindparam('project_path'),
+    Repository.enabled == True
+)
+
+# Repository per progetto, con l'istante di caricamento: la configurazione cambia di rado
+_repositories_cache: Dict[str, Tuple[float, List[Repository]]] = {}
+
 def find_repositories(session: Session, project_path: str) -> List[Repository]:
-    """Trova tutti i repository abilitati per il progetto"""
-    return session.exec(
-        select(Repository).where(
-            Repository.name == project_path,
-            Repository.enabled == True
-        )
+    """Trova tutti i repository abilitati per il progetto (in cache per REPO_CACHE_TTL secondi)"""
+    now = time.monotonic()
+    cached = _repositories_cache.get(project_path)
+    if cached is not None and now - cached[0] <= REPO_CACHE_TTL:
+        return cached[1]
+    repositories = session.exec(
+        FIND_REPOSITORIES_STMT,
+        params={'project_path': project_path}
     ).all()
+    # Le istanze in cache vengono lette dopo la chiusura della sessione:
+    # servono solo le colonne, già caricate
+    _repositories_cache[project_path] = (now, repositories)
+    return repositories
 
 def get_platform_queue_name(platform_id: int) -> str:
     """Genera il nome della coda per una specifica piattaforma"""
@@ -150,51 +183,64 @@ def schedule_builds(
     builds = []
     builds_by_platform = {}  # Raggruppa build per piattaforma
     
+    # Le consegne dello stesso tag (retry di GitLab, più hook sul progetto) girano in
+    # parallelo nel threadpool e builds, partizionata per data, non ha un vincolo di
+    # unicità: un advisory lock fino al commit serializza verifica e inserimento
+    if session.get_bind().dialect.name == "postgresql":
+        session.exec(select(func.pg_advisory_xact_lock(
+            func.hashtext(f"{webhook.project.path_with_namespace}:{tag}")
+        )))
+    
+    # Build già esistenti per questo tag, con una sola query per tutti i repository
+    existing = set(session.exec(
+        select(Build.repository_id, Build.platform_id).where(
+            Build.repository_id.in_([r.id for r in repositories]),
+            Build.tag == tag
+        )
+    ).all())
+    
+    new_builds = []
     for repository in repositories:
-        # Verifica se esiste già una build per questo tag e piattaforma
-        existing_build = session.exec(
-            select(Build).where(
-                Build.repository_id == repository.id,
-                Build.platform_id == repository.platform_id,
-                Build.tag == tag
-            )
-        ).first()
+        if (repository.id, repository.platform_id) in existing:
+            continue
+        build = Build(
+            repository_id=repository.id,
+            platform_id=repository.platform_id,
+            tag=tag,
+            status=BuildStatus.SCHEDULED
+        )
+        session.add(build)
+        new_builds.append((repository, build))
         
-        if not existing_build:
-            build = Build(
-                repository_id=repository.id,
-                platform_id=repository.platform_id,
-                tag=tag,
-                status=BuildStatus.SCHEDULED
-            )
-            session.add(build)
-            session.commit()
-            session.refresh(build)
-            
-            # Prepara i dati per Celery
-            build_task = {
-                "build_id": build.id,
-                "repository_id": repository.id,
-                "platform_id": repository.platform_id,
-                "tag": tag,
-                "repository_name": repository.name,
-                "repository_url": webhook.project.ssh_url,
-                "repository_type": repository.type,
-                "user_email": webhook.commits[0].author.email if webhook.commits else webhook.user_email,
-                "default_branch": webhook.project.default_branch,
-                # Email multiple per compatibilità con vecchio sistema
-                "emails": [
-                    webhook.commits[0].author.email if webhook.commits else None,
-                    f"{webhook.user_username}@elettra.eu",
-                    webhook.user_email
-                ]
-            }
-            
-            # Raggruppa per piattaforma
-            if repository.platform_id not in builds_by_platform:
-                builds_by_platform[repository.platform_id] = []
-            builds_by_platform[repository.platform_id].append(build_task)
-            builds.append(build)
+    # Un solo commit per tutte le build, prima di accodarle
+    session.commit()
+    
+    for repository, build in new_builds:
+        # Prepara i dati per Celery
+        build_task = {
+            "build_id": build.id,
+            "repository_id": repository.id,
+            "platform_id": repository.platform_id,
+            "tag": tag,
+            "tag_sha": webhook.after,
+            "repository_name": repository.name,
+            "repository_url": webhook.project.ssh_url,
+            "repository_type": repository.type,
+            "user_email": webhook.commits[0].author.email if webhook.commits else webhook.user_email,
+            "default_branch": webhook.project.default_branch,
+            # Email multiple per compatibilità con vecchio sistema
+            "emails": [
+                webhook.commits[0].author.email if webhook.commits else None,
+                f"{webhook.user_username}@elettra.eu",
+                webhook.user_email
+            ]
+        }
+        
+        # Raggruppa per piattaforma
+        if repository.platform_id not in builds_by_platform:
+            builds_by_platform[repository.platform_id] = []
+        builds_by_platform[repository.platform_id].append(build_task)
+        builds.append(build)
     
     # Invia i task alle code appropriate per piattaforma
     for platform_id, platform_builds in builds_by_platform.items():
@@ -221,7 +267,7 @@ def notify_celery_worker(build_task: dict, platform_id: int):
 # Endpoints
 
 @app.get("/health")
-async def health_check():
+def health_check():
     """Health check endpoint"""
     health = {
         "status": "ok",
@@ -248,29 +294,67 @@ async def health_check():
     
     return health
 
+async def read_tag_push_payload(
+    request: Request,
+    x_gitlab_event: Optional[str] = Header(None)
+) -> Optional[dict]:
+    """Legge il payload JSON, ma solo se l'header GitLab non esclude già un tag push"""
+    if x_gitlab_event is not None and x_gitlab_event not in TAG_PUSH_EVENTS:
+        return None
+    # Payload fuori misura rifiutati prima di leggerli
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_PAYLOAD_SIZE:
+        raise HTTPException(status_code=413, detail="Payload too large")
+    try:
+        payload = json.loads(await request.body())
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Invalid JSON payload")
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=422, detail="Invalid JSON payload")
+    return payload
+
 @app.post("/")
-async def handle_gitlab_webhook(
-    webhook: GitLabWebhook,
+def handle_gitlab_webhook(
+    payload: Optional[dict] = Depends(read_tag_push_payload),
     session: Session = Depends(get_session)
 ):
     """
     Gestisce i webhook di GitLab per i tag push
+    
+    Definito come funzione sincrona: FastAPI lo esegue nel threadpool, così le
+    chiamate bloccanti a database e broker non fermano l'event loop.
+    Il payload viene validato solo per i tag push: gli altri eventi (push su
+    branch, merge request), che sono la maggioranza, vengono scartati subito.
     """
+    # Verifica che sia un tag push (senza header X-Gitlab-Event decide il payload)
+    if payload is None or payload.get("object_kind") != "tag_push":
+        return JSONResponse(
+            status_code=200,
+            content={"message": "Ignored: not a tag push event"}
+        )
+    
+    # Ignora cancellazione di tag
+    after = payload.get("after")
+    if after == NULL_SHA:
+        return JSONResponse(
+            status_code=200,
+            content={"message": "Ignored: tag deletion"}
+        )
+    
+    # Verifica che non sia un tag lightweight (after == commit id)
+    commits = payload.get("commits")
+    if commits and isinstance(commits[0], dict) and after == commits[0].get("id"):
+        return JSONResponse(
+            status_code=200,
+            content={"message": "Ignored: lightweight tag"}
+        )
+    
+    try:
+        webhook = GitLabWebhook.model_validate(payload)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+    
     try:
-        # Verifica che sia un tag push
-        if webhook.object_kind != "tag_push":
-            return JSONResponse(
-                status_code=200,
-                content={"message": "Ignored: not a tag push event"}
-            )
-        
-        # Ignora cancellazione di tag
-        if webhook.after == '0000000000000000000000000000000000000000':
-            return JSONResponse(
-                status_code=200,
-                content={"message": "Ignored: tag deletion"}
-            )
-        
         # Estrai il tag dal ref
         tag = extract_tag_from_ref(webhook.ref)
         if not tag:
@@ -279,13 +363,6 @@ async def handle_gitlab_webhook(
                 content={"error": "Invalid tag reference"}
             )
         
-        # Verifica che non sia un tag lightweight (after == commit id)
-        if webhook.commits and webhook.after == webhook.commits[0].id:
-            return JSONResponse(
-                status_code=200,
-                content={"message": "Ignored: lightweight tag"}
-            )
-        
         logger.info(f"Received tag push: {tag} for project {webhook.project.path_with_namespace}")
         
         # Trova tutti i repository configurati per questo progetto
@@ -321,7 +398,7 @@ async def handle_gitlab_webhook(
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/queues")
-async def get_active_queues(session: Session = Depends(get_session)):
+def get_active_queues(session: Session = Depends(get_session)):
     """
     Endpoint di utilità per visualizzare le code attive per piattaforma
     """